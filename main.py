@@ -1,11 +1,225 @@
+import hashlib
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from io import StringIO
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
 import warnings
-warnings.filterwarnings('ignore')
+# pd.to_datetime warns when it falls back to per-element parsing or when a
+# dayfirst hint contradicts the data; both are expected while auto-detecting
+# the date format of uploads
+warnings.filterwarnings("ignore", message="Could not infer format", category=UserWarning)
+warnings.filterwarnings("ignore", message="Parsing dates in .* format when dayfirst=", category=UserWarning)
+
+from utils import (
+    detect_date_format,
+    is_valid_time_series,
+    lttb_downsample,
+    resample_mean,
+)
+
+# Maximum points per trace sent to the browser
+MAX_PLOT_POINTS = 2000
+
+# Caches are shared by all sessions; bound how many results each one keeps
+MAX_CACHED_FILES = 64
+MAX_CACHED_VIEWS = 16
+
+
+class InvalidTimeSeriesError(ValueError):
+    """Raised when the first column of an upload does not look like timestamps."""
+
+
+class DatetimeConversionError(ValueError):
+    """Raised when the first column of an upload cannot be converted to datetime."""
+
+
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_FILES)
+def _load_file(name, data, dayfirst_forced):
+    """
+    Parse an uploaded file and convert its first column to datetime.
+    Cached on the file name and raw bytes, so reruns with unchanged uploads
+    skip parsing entirely.
+    Returns (table, detected_dayfirst, digest) with the data as a pyarrow
+    Table and a blake2b digest of the file contents.
+    """
+    # Read file based on extension
+    if name.endswith(('.xlsx', '.xls')):
+        # Rust-backed calamine reader handles both formats and is much faster
+        # than openpyxl/xlrd
+        with pd.ExcelFile(BytesIO(data), engine="calamine") as xl:
+            df = xl.parse(xl.sheet_names[0])
+    else:  # CSV
+        # The multithreaded pyarrow reader is much faster; fall back to the
+        # default C engine for files it cannot handle. The timestamp column is
+        # read as text so pd.to_datetime below keeps any UTC offsets (pyarrow
+        # would convert them to UTC).
+        first_col = pd.read_csv(BytesIO(data), nrows=0).columns[0]
+        try:
+            df = pd.read_csv(BytesIO(data), engine="pyarrow", dtype={first_col: str})
+            # pyarrow does not rename duplicate headers like temp -> temp.1
+            if df.columns.duplicated().any():
+                raise ValueError("duplicate column names")
+        except Exception:
+            df = pd.read_csv(BytesIO(data))
+
+    # Validate that first column is actually time series data
+    if not is_valid_time_series(df.iloc[:, 0]):
+        raise InvalidTimeSeriesError(name)
+
+    # Use forced format or auto-detect
+    if dayfirst_forced:
+        detected_dayfirst = True
+    else:
+        detected_dayfirst = detect_date_format(df.iloc[:, 0])
+
+    try:
+        # Assign by label so the column takes the datetime64 dtype; .iloc
+        # assignment would keep an object column holding Timestamps
+        df[df.columns[0]] = pd.to_datetime(df.iloc[:, 0], dayfirst=detected_dayfirst)
+    except Exception as e:
+        raise DatetimeConversionError(name) from e
+
+    # Downcast integer columns, which is lossless. Floats stay float64:
+    # float32 would change the values users see in the data table.
+    for col in df.select_dtypes("integer").columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+
+    # Store as an Arrow table: columnar, immutable, and cheap to concatenate.
+    # Mixed-type object columns (e.g. numbers with "N/A" text) become strings.
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        object_cols = df.select_dtypes("object").columns
+        df[object_cols] = df[object_cols].astype("string")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+    return table, detected_dayfirst, hashlib.blake2b(data).digest()
+
+
+def _try_load_file(file, dayfirst_forced):
+    """
+    Run _load_file for an uploaded file, returning (result, error) instead of
+    raising so it can be mapped over a thread pool.
+    """
+    try:
+        return _load_file(file.name, file.getvalue(), dayfirst_forced), None
+    except Exception as e:
+        return None, e
+
+
+def _files_signature(file_keys):
+    """
+    Cache key for the loaded files: (name, content digest, dayfirst) per file,
+    in upload order. The builder caches are shared across sessions, so the
+    key must identify the data itself, not just its shape.
+    """
+    return tuple((name, *key) for name, key in file_keys.items())
+
+
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_VIEWS)
+def _build_combined_df(files_sig, _tables):
+    """
+    Concatenate all loaded files and ensure the timestamp column is datetime.
+    Keyed on files_sig only; _tables is excluded from hashing.
+    """
+    # Columns missing from some files are filled with nulls and differing
+    # numeric types are promoted. Arrow cannot merge a column that is numeric
+    # in one file and text in another; concatenate in pandas instead, which
+    # gives an object column as before.
+    try:
+        combined = pa.concat_tables(_tables.values(), promote_options="permissive")
+        combined_df = combined.to_pandas()
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        combined_df = pd.concat(
+            [table.to_pandas() for table in _tables.values()],
+            ignore_index=True,
+            sort=False
+        )
+    
+    # Ensure timestamp column is datetime (uploads are normally already converted)
+    timestamp_col = combined_df.columns[0]
+    if not pd.api.types.is_datetime64_any_dtype(combined_df[timestamp_col]):
+        combined_df[timestamp_col] = pd.to_datetime(combined_df[timestamp_col])
+    
+    # Sort once by time so date filtering can use searchsorted
+    combined_df = combined_df.sort_values(timestamp_col, kind="mergesort").reset_index(drop=True)
+    
+    return combined_df
+
+
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_VIEWS)
+def _build_display_df(files_sig, _tables, start_date, end_date, resample_code):
+    """
+    Filter the combined data to [start_date, end_date] and optionally resample.
+    Only the file signature and the filter widgets invalidate the cache.
+    """
+    combined_df = _build_combined_df(files_sig, _tables)
+    timestamp_col = combined_df.columns[0]
+    
+    if start_date is not None and end_date is not None:
+        # Filter combined_df based on date range (end date is inclusive).
+        # combined_df is time-sorted, so the range is a contiguous slice.
+        start_ts = pd.Timestamp(start_date)
+        end_ts = pd.Timestamp(end_date) + pd.Timedelta("1D")
+        ts_vals = combined_df[timestamp_col].to_numpy("datetime64[ns]")
+        lo, hi = np.searchsorted(ts_vals, [start_ts.to_datetime64(), end_ts.to_datetime64()])
+        filtered_df = combined_df.iloc[lo:hi]
+    else:
+        filtered_df = combined_df
+    
+    # Apply resampling if selected
+    if resample_code:
+        return resample_mean(filtered_df, timestamp_col, resample_code)
+    
+    return filtered_df
+
+
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_VIEWS)
+def _build_column_stats(files_sig, start_date, end_date, resample_code, _display_df):
+    """
+    Summary statistics and non-null date range for each numeric column.
+    Keyed on the same arguments as _build_display_df, which produced _display_df.
+    """
+    timestamp_col = _display_df.columns[0]
+    numeric_df = _display_df.select_dtypes(include=['number'])
+    non_null_mask = numeric_df.notna()
+    
+    # Skip columns with no data in the current range
+    numeric_df = numeric_df.loc[:, non_null_mask.any().values]
+    non_null_mask = non_null_mask[numeric_df.columns]
+    if numeric_df.columns.empty:
+        return pd.DataFrame()
+    
+    # All statistics in one pass over the numeric block, in float64 so
+    # downcast columns do not show float32 rounding noise
+    stats = numeric_df.astype("float64").agg(["mean", "median", "std", "min", "max"]).T
+    
+    # Find date range for non-null values. _display_df is time-sorted, so the
+    # first/last non-null row of each column gives its min/max timestamp.
+    ts_vals = _display_df[timestamp_col].to_numpy("datetime64[ns]")
+    mask = non_null_mask.to_numpy() & ~np.isnat(ts_vals)[:, None]
+    first_idx = mask.argmax(axis=0)
+    last_idx = len(mask) - 1 - mask[::-1].argmax(axis=0)
+    date_range_start = pd.to_datetime(ts_vals[first_idx])
+    date_range_end = pd.to_datetime(ts_vals[last_idx])
+    
+    return pd.DataFrame({
+        "Column": numeric_df.columns,
+        "Mean": [f"{v:.4f}" for v in stats["mean"]],
+        "Median": [f"{v:.4f}" for v in stats["median"]],
+        "Std Dev": [f"{v:.4f}" for v in stats["std"]],
+        "Min": [f"{v:.4f}" for v in stats["min"]],
+        "Max": [f"{v:.4f}" for v in stats["max"]],
+        "Data Range": [
+            f"{start:%Y-%m-%d} to {end:%Y-%m-%d}"
+            for start, end in zip(date_range_start, date_range_end)
+        ]
+    })
 
-from utils import detect_date_format, is_valid_time_series
 
 # Page configuration
 st.set_page_config(page_title="Trend Plotter", layout="wide")
@@ -14,6 +228,8 @@ st.title("📊 Trend Plotter")
 # Initialize session state
 if "dataframes" not in st.session_state:
     st.session_state.dataframes = {}
+if "file_keys" not in st.session_state:
+    st.session_state.file_keys = {}
 
 # Create tabs
 tab_analyze, tab_help = st.tabs(["Analyze", "Help"])
@@ -67,38 +283,45 @@ with tab_analyze:
 
     # Process uploaded files
     if uploaded_files:
+        new_files = {}
         for file in uploaded_files:
             if file.name not in st.session_state.dataframes:
-                try:
-                    # Read file based on extension
-                    if file.name.endswith(('.xlsx', '.xls')):
-                        df = pd.read_excel(file)
-                    else:  # CSV
-                        df = pd.read_csv(file)
-                    
-                    # Try to convert first column to datetime
-                    try:
-                        # Validate that first column is actually time series data
-                        if not is_valid_time_series(df.iloc[:, 0]):
-                            st.sidebar.error(f"❌ {file.name}: First column must contain datetime values. File rejected.")
-                            continue
-                        
-                        # Use forced format or auto-detect
-                        if force_dayfirst:
-                            detected_dayfirst = True
-                            format_msg = "📅 Day-first (forced)"
-                        else:
-                            detected_dayfirst = detect_date_format(df.iloc[:, 0])
-                            format_msg = "🔍 Day-first detected" if detected_dayfirst else "🔍 Month-first detected"
-                        
-                        df.iloc[:, 0] = pd.to_datetime(df.iloc[:, 0], dayfirst=detected_dayfirst)
-                        
-                        st.session_state.dataframes[file.name] = df
-                        st.sidebar.success(f"✓ {file.name} loaded ({format_msg})")
-                    except Exception as e:
-                        st.sidebar.error(f"❌ {file.name}: First column is not datetime format. File rejected.")
-                except Exception as e:
-                    st.sidebar.error(f"❌ Error reading {file.name}: {str(e)}")
+                new_files.setdefault(file.name, file)
+        
+        # Parse new files in parallel; session_state is only touched below,
+        # back on the script thread
+        results = []
+        if new_files:
+            with ThreadPoolExecutor(
+                max_workers=min(8, len(new_files)),
+                initializer=add_script_run_ctx,
+                initargs=(None, get_script_run_ctx())
+            ) as executor:
+                results = list(executor.map(
+                    lambda f: _try_load_file(f, force_dayfirst),
+                    new_files.values()
+                ))
+        
+        for file, (loaded, error) in zip(new_files.values(), results):
+            if isinstance(error, InvalidTimeSeriesError):
+                st.sidebar.error(f"❌ {file.name}: First column must contain datetime values. File rejected.")
+                continue
+            elif isinstance(error, DatetimeConversionError):
+                st.sidebar.error(f"❌ {file.name}: First column is not datetime format. File rejected.")
+                continue
+            elif error is not None:
+                st.sidebar.error(f"❌ Error reading {file.name}: {str(error)}")
+                continue
+            
+            table, detected_dayfirst, digest = loaded
+            if force_dayfirst:
+                format_msg = "📅 Day-first (forced)"
+            else:
+                format_msg = "🔍 Day-first detected" if detected_dayfirst else "🔍 Month-first detected"
+            
+            st.session_state.dataframes[file.name] = table
+            st.session_state.file_keys[file.name] = (digest, detected_dayfirst)
+            st.sidebar.success(f"✓ {file.name} loaded ({format_msg})")
 
     # Display uploaded files
     if st.session_state.dataframes:
@@ -109,6 +332,7 @@ with tab_analyze:
     # Clear data button
     if st.sidebar.button("🗑️ Clear Data", use_container_width=True):
         st.session_state.dataframes = {}
+        st.session_state.file_keys = {}
         st.rerun()
 
     # Main content area
@@ -116,20 +340,13 @@ with tab_analyze:
     if not st.session_state.dataframes:
         st.info("📤 Upload CSV or Excel files to get started. The first column should be a timestamp.")
     else:
-        # Combine all dataframes
-        combined_df = pd.concat(
-            st.session_state.dataframes.values(),
-            ignore_index=False,
-            sort=False
-        )
+        files_sig = _files_signature(st.session_state.file_keys)
+        combined_df = _build_combined_df(files_sig, st.session_state.dataframes)
         
         # Get all available columns (excluding timestamp)
         timestamp_col = combined_df.columns[0]
         available_cols = list(combined_df.columns[1:])
         
-        # Ensure timestamp column is datetime
-        combined_df[timestamp_col] = pd.to_datetime(combined_df[timestamp_col])
-        
         # Resample and date range in main content
         col_filter1, col_filter2 = st.columns(2)
         
@@ -170,23 +387,16 @@ with tab_analyze:
         # Handle date range selection
         if len(date_range) == 2:
             start_date, end_date = date_range
-            # Filter combined_df based on date range
-            filtered_df = combined_df[
-                (combined_df[timestamp_col].dt.date >= start_date) &
-                (combined_df[timestamp_col].dt.date <= end_date)
-            ].copy()
         else:
-            filtered_df = combined_df.copy()
+            start_date, end_date = None, None
         
-        # Apply resampling if selected
-        if resample_map[resample_option]:
-            # Set timestamp as index for resampling
-            df_resampled = filtered_df.set_index(timestamp_col)
-            df_resampled = df_resampled.resample(resample_map[resample_option]).mean()
-            df_resampled = df_resampled.reset_index()
-            display_df = df_resampled
-        else:
-            display_df = filtered_df
+        display_df = _build_display_df(
+            files_sig,
+            st.session_state.dataframes,
+            start_date,
+            end_date,
+            resample_map[resample_option]
+        )
 
 
         # Show data summary
@@ -218,30 +428,15 @@ with tab_analyze:
 
         # Column statistics
         with st.expander("📈 Column Statistics"):
-            stats_data = []
-            numeric_cols = display_df.select_dtypes(include=['number']).columns
-            
-            for col in numeric_cols:
-                col_data = display_df[col].dropna()
-                if len(col_data) > 0:
-                    # Find date range for non-null values
-                    non_null_mask = display_df[col].notna()
-                    non_null_dates = display_df.loc[non_null_mask, timestamp_col]
-                    date_range_start = non_null_dates.min().strftime("%Y-%m-%d")
-                    date_range_end = non_null_dates.max().strftime("%Y-%m-%d")
-                    
-                    stats_data.append({
-                        "Column": col,
-                        "Mean": f"{col_data.mean():.4f}",
-                        "Median": f"{col_data.median():.4f}",
-                        "Std Dev": f"{col_data.std():.4f}",
-                        "Min": f"{col_data.min():.4f}",
-                        "Max": f"{col_data.max():.4f}",
-                        "Data Range": f"{date_range_start} to {date_range_end}"
-                })
+            stats_df = _build_column_stats(
+                files_sig,
+                start_date,
+                end_date,
+                resample_map[resample_option],
+                display_df
+            )
             
-            if stats_data:
-                stats_df = pd.DataFrame(stats_data)
+            if not stats_df.empty:
                 st.dataframe(stats_df, use_container_width=True)
             else:
                 st.info("No numeric columns to display statistics for.")
@@ -271,12 +466,22 @@ with tab_analyze:
         if primary_cols or secondary_cols:
             fig = go.Figure()
             
+            # Resolve the shared x-array once; traces that are not downsampled
+            # all reference this same array
+            x_arr = display_df[timestamp_col].to_numpy()
+            
             # Add primary axis traces
             for col in primary_cols:
+                x, y = lttb_downsample(
+                    x_arr,
+                    display_df[col].values,
+                    MAX_PLOT_POINTS
+                )
                 fig.add_trace(
-                    go.Scatter(
-                        x=display_df[timestamp_col],
-                        y=display_df[col],
+                    go.Scattergl(
+                        x=x,
+                        y=y,
+                        mode="lines",
                         name=col,
                         yaxis="y1"
                     )
@@ -284,10 +489,16 @@ with tab_analyze:
             
             # Add secondary axis traces
             for col in secondary_cols:
+                x, y = lttb_downsample(
+                    x_arr,
+                    display_df[col].values,
+                    MAX_PLOT_POINTS
+                )
                 fig.add_trace(
-                    go.Scatter(
-                        x=display_df[timestamp_col],
-                        y=display_df[col],
+                    go.Scattergl(
+                        x=x,
+                        y=y,
+                        mode="lines",
                         name=col,
                         yaxis="y2"
                     )
@@ -304,7 +515,7 @@ with tab_analyze:
                 template="plotly_white"
             )
             
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(fig, use_container_width=True, key="trend_plot", on_select="ignore")
         else:
             # Display empty placeholder chart
             fig_placeholder = go.Figure()
@@ -326,7 +537,7 @@ with tab_analyze:
                 template="plotly_white",
                 showlegend=False
             )
-            st.plotly_chart(fig_placeholder, use_container_width=True)
+            st.plotly_chart(fig_placeholder, use_container_width=True, key="trend_plot", on_select="ignore")
         
         # Display combined dataframe
         with st.expander("📋 Data Table"):
@@ -2,16 +2,19 @@
 Utility functions for Trend Plotter
 """
 
-import re
+import numpy as np
 import pandas as pd
-from dateutil import parser as date_parser
+
+# Day/month/year components of a date, e.g. 31/01/2024, 2024-01-31, 01.02.24
+_DATE_PART_PATTERN = r'(\d{1,4})[/.-](\d{1,2})[/.-](\d{1,4})'
 
 
 def detect_date_format(date_series):
     """
     Auto-detect if dates are in day-first or month-first format.
-    Uses chronological ordering: assumes timestamps should be in order and
-    checks which format produces an ordered sequence.
+    A day or month component above 12 settles the format immediately.
+    Otherwise uses chronological ordering: assumes timestamps should be in
+    order and checks which format produces an ordered sequence.
     Returns True if day-first produces ordered timestamps, False if month-first does.
     """
     # Sample non-null values
@@ -19,68 +22,60 @@ def detect_date_format(date_series):
     if len(sample) < 2:
         return False
     
-    dayfirst_result = []
-    monthfirst_result = []
-    parse_success = {"dayfirst": 0, "monthfirst": 0}
+    # Short-circuit on values that are impossible in one of the formats.
+    # Only the date part is scanned, so a leading time (13:45 01/02/2024) is
+    # ignored. Year-first dates (e.g. ISO 2024-01-31) are read year-month-day
+    # unless the middle number can only be a day.
+    date_parts = sample.str.extract(_DATE_PART_PATTERN).dropna().astype(int)
+    for first_val, second_val, _ in date_parts.itertuples(index=False):
+        if first_val > 31:
+            return bool(second_val > 12)
+        if first_val > 12:
+            return True
+        if second_val > 12:
+            return False
     
     # Try parsing with both formats
-    for date_str in sample:
-        try:
-            parsed_df = date_parser.parse(date_str, dayfirst=True, fuzzy=False)
-            dayfirst_result.append(parsed_df)
-            parse_success["dayfirst"] += 1
-        except:
-            dayfirst_result.append(None)
-        
-        try:
-            parsed_mf = date_parser.parse(date_str, dayfirst=False, fuzzy=False)
-            monthfirst_result.append(parsed_mf)
-            parse_success["monthfirst"] += 1
-        except:
-            monthfirst_result.append(None)
-    
-    # Filter out None values for ordering checks
-    dayfirst_valid = [d for d in dayfirst_result if d is not None]
-    monthfirst_valid = [d for d in monthfirst_result if d is not None]
-    
-    if not dayfirst_valid or not monthfirst_valid:
+    dayfirst_parsed = pd.to_datetime(sample, dayfirst=True, errors="coerce")
+    monthfirst_parsed = pd.to_datetime(sample, dayfirst=False, errors="coerce")
+    dayfirst_failures = dayfirst_parsed.isna().sum()
+    monthfirst_failures = monthfirst_parsed.isna().sum()
+
+    if dayfirst_failures == len(sample) and monthfirst_failures == len(sample):
         return False
-    
-    # Check if dates are in chronological order (allowing equal consecutive values)
-    def is_ordered(date_list):
-        for i in range(len(date_list) - 1):
-            if date_list[i] > date_list[i + 1]:  # Out of order if current > next
-                return False
+
+    # A format that fails to parse more samples than the other is wrong
+    if dayfirst_failures < monthfirst_failures:
         return True
-    
-    dayfirst_ordered = is_ordered(dayfirst_valid)
-    monthfirst_ordered = is_ordered(monthfirst_valid)
-    
+    elif monthfirst_failures < dayfirst_failures:
+        return False
+
+    # Check if dates are in chronological order (allowing equal consecutive
+    # values). Failed parses are kept as NaT, which counts as out of order.
+    def is_ordered(dates):
+        return dates.is_monotonic_increasing or dates.is_monotonic_decreasing
+
+    dayfirst_ordered = is_ordered(dayfirst_parsed)
+    monthfirst_ordered = is_ordered(monthfirst_parsed)
+
     # If only one format produces ordered dates, use that
     if dayfirst_ordered and not monthfirst_ordered:
         return True
     elif monthfirst_ordered and not dayfirst_ordered:
         return False
-    
+
     # If both or neither are ordered, fall back to detecting impossible values
-    dayfirst_evidence = 0
-    monthfirst_evidence = 0
-    
-    for date_str in sample:
-        numbers = re.findall(r'\d+', date_str)
-        
-        if len(numbers) >= 2:
-            first_val = int(numbers[0])
-            second_val = int(numbers[1])
-            
-            if first_val > 12:
-                dayfirst_evidence += 2
-            elif second_val > 12:
-                monthfirst_evidence += 2
-            elif first_val > second_val:
-                dayfirst_evidence += 1
-    
-    return dayfirst_evidence > monthfirst_evidence
+    first_val = date_parts[0]
+    second_val = date_parts[1]
+
+    dayfirst_mask = first_val > 12
+    monthfirst_mask = ~dayfirst_mask & (second_val > 12)
+    weak_dayfirst_mask = ~dayfirst_mask & ~monthfirst_mask & (first_val > second_val)
+
+    dayfirst_evidence = 2 * dayfirst_mask.sum() + weak_dayfirst_mask.sum()
+    monthfirst_evidence = 2 * monthfirst_mask.sum()
+
+    return bool(dayfirst_evidence > monthfirst_evidence)
 
 
 def is_valid_time_series(date_series):
@@ -97,14 +92,122 @@ def is_valid_time_series(date_series):
     
     # Try to parse a sample
     sample = date_series.dropna().head(5).astype(str)
-    valid_dates = 0
+    if len(sample) == 0:
+        return False
+    
+    # At least 80% of sample must be valid dates. Each value is parsed on its
+    # own (format="mixed"), so one value's format is not imposed on the rest,
+    # e.g. 10/03/2024 must not make 13/03/2024 invalid.
+    parsed = pd.to_datetime(sample, format="mixed", errors="coerce")
+    return parsed.notna().mean() >= 0.8
+
+
+def resample_mean(df, timestamp_col, freq, max_gap_bins=1000):
+    """
+    Resample a time-sorted DataFrame to freq using the mean.
+    Gaps longer than max_gap_bins intervals split the data into subgroups that
+    are resampled separately, so a stray outlier timestamp does not allocate
+    millions of empty bins. A single empty (NaN) bin is kept after each
+    subgroup so the gap still shows. Calendar frequencies (e.g. month start)
+    have no fixed length and are resampled in one go.
+    """
+    try:
+        bin_width = pd.Timedelta(pd.tseries.frequencies.to_offset(freq).nanos)
+    except ValueError:
+        bin_width = None
+    
+    bounds = [0, len(df)]
+    if bin_width is not None:
+        gaps = df[timestamp_col].diff()
+        splits = np.flatnonzero((gaps > bin_width * max_gap_bins).to_numpy())
+        bounds = [0, *splits, len(df)]
+    
+    chunks = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        chunk = df.iloc[start:end].set_index(timestamp_col).resample(freq).mean()
+        if chunks:
+            # One empty bin after the previous subgroup keeps the gap visible
+            # as a break in the plotted line, as a single-pass resample would
+            gap_row = pd.DataFrame(
+                np.nan,
+                index=pd.DatetimeIndex([chunks[-1].index[-1] + bin_width], name=timestamp_col),
+                columns=chunk.columns
+            ).astype(chunk.dtypes.to_dict())
+            chunks.append(gap_row)
+        chunks.append(chunk)
+    return pd.concat(chunks).reset_index()
+
+
+def lttb_downsample(x, y, n_out):
+    """
+    Downsample a series to n_out points with Largest-Triangle-Three-Buckets.
+    Preserves the visual shape of the line (peaks and troughs) while bounding
+    the number of points sent to the browser. NaN values of y are skipped
+    while bucketing, then a single NaN is put back wherever the source had a
+    gap, so the line still breaks at missing data.
+    x may be numeric or datetimes, including tz-aware Timestamps.
+    Returns (x, y) unchanged if y is non-numeric or already has n_out
+    non-null points or fewer.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if not np.issubdtype(y.dtype, np.number):
+        return x, y
+    
+    y = y.astype(float)
+    valid = ~np.isnan(y)
+    if n_out < 3 or valid.sum() <= n_out:
+        return x, y
+    x_all = x
+    valid_idx = np.flatnonzero(valid)
+    x, y = x[valid], y[valid]
+    n = len(x)
+    
+    # Work on numeric x (datetimes -> int64 nanoseconds). Tz-aware timestamps
+    # arrive as an object array of Timestamps; the original x is kept for the
+    # output either way.
+    if np.issubdtype(x.dtype, np.datetime64) or pd.api.types.infer_dtype(x) == "datetime":
+        x_num = pd.DatetimeIndex(x).asi8.astype(float)
+    else:
+        x_num = x.astype(float)
+    
+    # First and last points are always kept; the rest are split into buckets
+    every = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    
+    for i in range(n_out - 2):
+        bucket_start = int(i * every) + 1
+        bucket_end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        
+        # Average of the next bucket is the third vertex of the triangle
+        avg_x = x_num[bucket_end:next_end].mean()
+        avg_y = y[bucket_end:next_end].mean()
+        
+        bx = x_num[bucket_start:bucket_end]
+        by = y[bucket_start:bucket_end]
+        areas = np.abs(
+            (x_num[a] - avg_x) * (by - y[a]) - (x_num[a] - bx) * (avg_y - y[a])
+        )
+        a = bucket_start + int(areas.argmax())
+        selected[i + 1] = a
+    
+    x_out, y_out = x[selected], y[selected]
+    if valid.all():
+        return x_out, y_out
     
-    for date_str in sample:
-        try:
-            parsed = date_parser.parse(date_str, fuzzy=False)  # fuzzy=False ensures strict parsing
-            valid_dates += 1
-        except:
-            pass
+    # Re-insert a NaN between consecutive selected points that straddle
+    # missing values in the source, at the x of the first missing row
+    source_idx = valid_idx[selected]
+    nan_idx = np.flatnonzero(~valid)
+    next_nan = np.searchsorted(nan_idx, source_idx[:-1])
+    next_nan_pos = nan_idx[np.minimum(next_nan, len(nan_idx) - 1)]
+    has_gap = (next_nan < len(nan_idx)) & (next_nan_pos < source_idx[1:])
+    gap_at = np.flatnonzero(has_gap)
     
-    # At least 80% of sample must be valid dates
-    return (valid_dates / len(sample)) >= 0.8 if len(sample) > 0 else False
+    x_out = np.insert(x_out, gap_at + 1, x_all[next_nan_pos[gap_at]])
+    y_out = np.insert(y_out, gap_at + 1, np.nan)
+    return x_out, y_out